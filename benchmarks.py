@@ -8,34 +8,489 @@
 # Created on 2014-04-02
 #
 
-"""
+"""Time Spotlight (`mdfind`) queries of increasing specificity.
+
+Each query is run once per root via its own `mdfind` call. For
+comparison, the queries are also answered from a single `mdfind`
+call per root: as every query contains the previous one, the results
+of the broadest query are simply filtered in Python for the others.
+They're also run in-process via Spotlight's `MDQuery` API (if PyObjC
+is installed), which saves starting an `mdfind` process per query.
+And they're also answered without Spotlight at all, by walking each
+root with `scandir` (if available).
+
+Every benchmark job (one method, one root) runs in its own worker
+process, because parsing `mdfind` output and walking directories are
+both CPU-bound. Jobs sharing one process would fight over the GIL, so
+each job's timing would depend on which other jobs happened to be
+running. The pool has one worker per CPU. Results are written out
+grouped by root.
+
+Each benchmark is run `TRIALS` + 1 times. The first (cold) run is
+reported separately from the rest (warm), so that one-off costs like
+loading the Spotlight index from disk don't swamp the steady-state
+figures.
+
+The timings of every run are written to STDOUT as CSV, so several
+runs of this script can be aggregated. A summary is printed to STDERR.
+
+With ``--exclude``, directories that are just noise for a folder
+search (``node_modules``, ``.git``, build output etc.) are marked with
+a ``.metadata_never_index`` file before benchmarking, so Spotlight
+drops them from its results. NOTE: this changes Spotlight's behaviour
+permanently. The marker files aren't removed afterwards.
+
 """
 
 from __future__ import print_function, unicode_literals
 
+import argparse
+import csv
+import math
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import os
+import re
 import subprocess
-from time import time
+import sys
+
+try:
+    from time import perf_counter_ns
+except ImportError:  # Python < 3.7
+    from timeit import default_timer
+
+    def perf_counter_ns():
+        """Return best available clock in nanoseconds."""
+        return int(default_timer() * 1e9)
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    from statistics import median
+except ImportError:  # Python 2
+    def median(values):
+        """Return median of `values`."""
+        values = sorted(values)
+        i = len(values) // 2
+        if len(values) % 2:
+            return values[i]
+        return (values[i - 1] + values[i]) / 2.0
 
 
 DIRS = [os.path.expanduser('~/Documents'), '/Volumes/Media/Video']
 
+# Directories to hide from Spotlight with ``--exclude``
+NOISY_DIRS = ('node_modules', '.git', 'dist', 'build', '.venv',
+              '__pycache__')
+
+# Number of threads walking a root's subdirectories in parallel
+SCAN_THREADS = 8
+
+# Number of warm runs of each benchmark
+TRIALS = 5
+
+# Benchmarks return lists of result rows with these fields
+FIELDS = ('root', 'query', 'method', 'kind', 'seconds', 'n')
+
+# Each query is a substring of the next
+QUERIES = ('i', 'in', 'inl')
+
+# Spotlight expressions for `QUERIES`
+EXPRESSIONS = ["(kMDItemFSName == '*{}*'c)".format(q) for q in QUERIES]
+
+
+def iter_records(stream, size=1 << 16):
+    """Yield NUL-terminated records (as bytes) read from `stream`."""
+    rest = b''
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        records = (rest + chunk).split(b'\x00')
+        rest = records.pop()
+        for record in records:
+            yield record
+    if rest:
+        yield rest
+
+
+def parse_record(record):
+    """Split a record output by `mdfind` into path and folder flag.
+
+    `mdfind` must have been called with ``-attr kMDItemContentType``,
+    so each record is the path followed by the item's content type.
+
+    :returns: ``(path, isfolder)`` tuple
+
+    """
+    path, _, ctype = record.rpartition(b' kMDItemContentType = ')
+    return path.rstrip(), ctype.strip(b'"') == b'public.folder'
+
 
 def get_num_results(cmd):
-    s = time()
-    output = subprocess.check_output(cmd).decode('utf-8')
-    print('\t`mdfind` finished in {:0.4f} seconds'.format(time() - s))
-    lines = [l.strip() for l in output.split('\n') if l.strip()]
-    return len(lines)
-
-for root in DIRS:
-    for query in ('i', 'in', 'inl'):
-        basecmd = ['mdfind', '-onlyin', root]
-        file_cmd = basecmd + ["(kMDItemFSName == '*{}*'c)".format(query)]
-        dir_cmd = basecmd + ["(kMDItemFSName == '*{}*'c) && (kMDItemContentType == 'public.folder')".format(query)]
-        s = time()
-        print('{} files found for `{}` in `{}` in {:0.4f} seconds'.format(
-              get_num_results(file_cmd), query, root, time() - s))
-        s = time()
-        print('{} folders found for `{}` in `{}` in {:0.4f} seconds'.format(
-              get_num_results(dir_cmd), query, root, time() - s))
+    """Return number of paths and folders output by `cmd`.
+
+    `cmd` must call `mdfind` with ``-0``, so each record is terminated
+    by a NUL, which (unlike newline) can't occur in a filename. They're
+    read straight from the pipe, so memory use stays the same however
+    many paths are found.
+
+    `cmd` must also fetch ``-attr kMDItemContentType``, so folders can
+    be counted from the same output rather than by a second `mdfind`
+    call or a ``stat()`` per path.
+
+    :returns: ``(paths, folders)`` tuple of counts
+
+    """
+    n = folders = 0
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    for record in iter_records(proc.stdout):
+        n += 1
+        if parse_record(record)[1]:
+            folders += 1
+    proc.stdout.close()
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return n, folders
+
+
+def get_paths(cmd):
+    """Return list of ``(path, isfolder)`` tuples for output of `cmd`.
+
+    `cmd` must call `mdfind` with ``-0 -attr kMDItemContentType``.
+    Paths are bytes.
+
+    """
+    output = subprocess.check_output(cmd)
+    return [parse_record(r) for r in output.split(b'\x00') if r]
+
+
+def time_query(root, query, cmd):
+    """Time `mdfind` command `cmd`.
+
+    :returns: list of result rows for files and folders
+
+    """
+    s = perf_counter_ns()
+    n, folders = get_num_results(cmd)
+    d = (perf_counter_ns() - s) / 1e9
+    return [(root, query, 'mdfind', kind, d, count)
+            for kind, count in (('files', n), ('folders', folders))]
+
+
+def time_cached(root, cmd):
+    """Time all `QUERIES` using only one `mdfind` call.
+
+    `cmd` must search for the first (broadest) query. The narrower
+    ones are answered by filtering its results.
+
+    :returns: list of result rows, two (files and folders) per query
+
+    """
+    rows = []
+    s = perf_counter_ns()
+    paths = get_paths(cmd)
+    for query in QUERIES:
+        if query != QUERIES[0]:
+            needle = query.encode('utf-8')
+            paths = [t for t in paths
+                     if needle in os.path.basename(t[0]).lower()]
+        folders = sum(1 for _, isfolder in paths if isfolder)
+        d = (perf_counter_ns() - s) / 1e9
+        for kind, count in (('files', len(paths)), ('folders', folders)):
+            rows.append((root, query, 'cached', kind, d, count))
+        s = perf_counter_ns()
+    return rows
+
+
+def time_mdquery(root, query, expr):
+    """Time Spotlight query `expr` run in-process via PyObjC.
+
+    This skips starting `mdfind` and parsing its output. Both counts
+    come straight from the query object, so no result paths are ever
+    created on the Python side.
+
+    PyObjC is imported here, in the worker process, not at the top of
+    the module: CoreFoundation isn't safe to use in a process forked
+    after the parent has loaded it.
+
+    :returns: list of result rows for files and folders, or an empty
+        list if PyObjC isn't installed
+
+    """
+    try:
+        from CoreServices import (
+            MDQueryCreate, MDQueryExecute, MDQueryGetResultCount,
+            MDQueryGetCountOfResultsWithAttributeValue, MDQuerySetSearchScope,
+            kMDQuerySynchronous)
+    except ImportError:
+        return []
+
+    s = perf_counter_ns()
+    q = MDQueryCreate(None, expr, ['kMDItemContentType'], None)
+    MDQuerySetSearchScope(q, [root], 0)
+    if not MDQueryExecute(q, kMDQuerySynchronous):
+        raise RuntimeError('MDQuery failed : {!r}'.format(expr))
+    n = MDQueryGetResultCount(q)
+    # Works because kMDItemContentType is a value-list attribute
+    folders = MDQueryGetCountOfResultsWithAttributeValue(
+        q, 'kMDItemContentType', 'public.folder')
+    d = (perf_counter_ns() - s) / 1e9
+    return [(root, query, 'mdquery', kind, d, count)
+            for kind, count in (('files', n), ('folders', folders))]
+
+
+def scan(root, match):
+    """Count entries under `root` whose names `match`.
+
+    `match` is a compiled regex's ``search`` method, so matching
+    happens in C and no lowercase copy of each name is needed. The
+    tree is walked with `scandir`, whose entries know whether they're
+    directories without needing another ``stat()`` call.
+
+    :returns: ``(paths, folders)`` tuple of counts
+
+    """
+    n = folders = 0
+    stack = [root]
+    while stack:
+        try:
+            entries = scandir(stack.pop())
+        except OSError:  # unreadable or missing directory
+            continue
+        for entry in entries:
+            isdir = entry.is_dir(follow_symlinks=False)
+            if match(entry.name):
+                n += 1
+                if isdir:
+                    folders += 1
+            if isdir:
+                stack.append(entry.path)
+    return n, folders
+
+
+def parallel_scan(root, match):
+    """Like :func:`scan`, but walk each subdirectory in its own thread.
+
+    Listing directories is I/O-bound, so several threads listing at
+    once keep the disk busy, GIL or no GIL.
+
+    :returns: ``(paths, folders)`` tuple of counts
+
+    """
+    n = folders = 0
+    subdirs = []
+    try:
+        entries = scandir(root)
+    except OSError:
+        return n, folders
+    for entry in entries:
+        isdir = entry.is_dir(follow_symlinks=False)
+        if match(entry.name):
+            n += 1
+            if isdir:
+                folders += 1
+        if isdir:
+            subdirs.append(entry.path)
+
+    pool = ThreadPool(SCAN_THREADS)
+    counts = pool.map(lambda path: scan(path, match), subdirs)
+    pool.close()
+    pool.join()
+    for i, j in counts:
+        n += i
+        folders += j
+    return n, folders
+
+
+def time_scan(root, query):
+    """Time walking `root` for entries matching `query`.
+
+    :returns: list of result rows for files and folders
+
+    """
+    match = re.compile(re.escape(query), re.IGNORECASE | re.UNICODE).search
+    s = perf_counter_ns()
+    n, folders = parallel_scan(root, match)
+    d = (perf_counter_ns() - s) / 1e9
+    return [(root, query, 'scandir', kind, d, count)
+            for kind, count in (('files', n), ('folders', folders))]
+
+
+def setup_exclusions(roots):
+    """Stop Spotlight indexing `NOISY_DIRS` under `roots`.
+
+    Creates a ``.metadata_never_index`` file in each such directory.
+    This permanently alters Spotlight's behaviour.
+
+    """
+    for root in roots:
+        for dirpath, dirnames, _ in os.walk(root):
+            for name in [n for n in dirnames if n in NOISY_DIRS]:
+                marker = os.path.join(dirpath, name, '.metadata_never_index')
+                if not os.path.exists(marker):
+                    open(marker, 'wb').close()
+                    print('excluded from Spotlight : {}'.format(
+                          os.path.dirname(marker)), file=sys.stderr)
+                # No need to look inside
+                dirnames.remove(name)
+
+
+def percentile(values, pct):
+    """Return `pct` percentile of `values` (nearest-rank method)."""
+    values = sorted(values)
+    i = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[max(i, 0)]
+
+
+def warm_up(root):
+    """Run a throwaway query to page in Spotlight's index for `root`."""
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(['mdfind', '-onlyin', root, 'dummy'],
+                              stdout=devnull)
+
+
+def run(job):
+    """Run benchmark `job` `TRIALS` + 1 times.
+
+    `job` is a ``(func, args)`` tuple.
+
+    :returns: list of ``(trial, rows)`` tuples. Trial 0 is the cold run.
+
+    """
+    func, args = job
+    return [(trial, func(*args)) for trial in range(TRIALS + 1)]
+
+
+def spotlight_jobs(root, queries):
+    """Return `mdfind` and `MDQuery` benchmark jobs for `queries`.
+
+    `queries` is a sequence of ``(query, expression)`` tuples.
+
+    """
+    cmd = ['mdfind', '-0', '-attr', 'kMDItemContentType', '-onlyin', root]
+    jobs = []
+    for query, expr in queries:
+        jobs.append((time_query, (root, query, cmd + [expr])))
+        jobs.append((time_mdquery, (root, query, expr)))
+    return jobs
+
+
+def other_jobs(root):
+    """Return the benchmark jobs for `root` that run all `QUERIES`."""
+    cmd = ['mdfind', '-0', '-attr', 'kMDItemContentType', '-onlyin', root,
+           EXPRESSIONS[0]]
+    jobs = [(time_cached, (root, cmd))]
+    if scandir is not None:
+        for query in QUERIES:
+            jobs.append((time_scan, (root, query)))
+    return jobs
+
+
+def skipped(root, query, methods):
+    """Return results (see :func:`run`) for skipped benchmarks.
+
+    Each of `methods` gets zero-count rows for `query`, so runs
+    that skipped queries still aggregate with those that didn't.
+
+    """
+    rows = [(root, query, method, kind, 0.0, 0)
+            for method in methods for kind in ('files', 'folders')]
+    return [(trial, rows) for trial in range(TRIALS + 1)]
+
+
+def bench(pool, roots):
+    """Run all benchmarks for `roots` in worker processes from `pool`.
+
+    The narrower Spotlight queries for a root wait on the broadest
+    `mdfind` benchmark's cold run. If that found nothing, Spotlight
+    won't find anything for them either, so they're skipped and get
+    zero-count rows instead.
+
+    Generator. Yields each root's benchmark results (see :func:`run`)
+    in the order of `roots`.
+
+    """
+    queries = list(zip(QUERIES, EXPRESSIONS))
+    broadest, pending = {}, {}
+    for root in roots:
+        warm_up(root)
+        broadest[root] = [pool.apply_async(run, (job,))
+                          for job in spotlight_jobs(root, queries[:1])]
+        pending[root] = [pool.apply_async(run, (job,))
+                         for job in other_jobs(root)]
+
+    for root in roots:
+        results = [r.get() for r in broadest[root]]
+        mdfind, mdquery = results
+        # Number of files found by cold run
+        if mdfind[0][1][0][-1]:
+            pending[root].extend(pool.apply_async(run, (job,)) for job in
+                                 spotlight_jobs(root, queries[1:]))
+        else:
+            print('nothing found for `{}` in `{}`: skipping narrower '
+                  'Spotlight queries'.format(QUERIES[0], root),
+                  file=sys.stderr)
+            # No `mdquery` rows at all if PyObjC isn't installed
+            methods = ['mdfind'] + (['mdquery'] if mdquery[0][1] else [])
+            results.extend(skipped(root, query, methods)
+                           for query, _ in queries[1:])
+        broadest[root] = results
+
+    for root in roots:
+        yield broadest[root] + [r.get() for r in pending[root]]
+
+
+def encode(value):
+    """Return `value` as something :mod:`csv` can write."""
+    if sys.version_info[0] == 2 and isinstance(value, type('')):
+        return value.encode('utf-8')
+    return value
+
+
+def write_results(out, results):
+    """Write a root's `results` from :func:`bench` to CSV writer `out`.
+
+    Also print a summary of them to STDERR.
+
+    """
+    for trials in results:
+        for trial, rows in trials:
+            for root, query, method, kind, d, n in rows:
+                out.writerow([encode(v) for v in
+                              (trial, root, query, method, kind,
+                               '{:.6f}'.format(d), n)])
+
+        # Summary
+        for i, (root, query, method, kind, cold, n) in enumerate(trials[0][1]):
+            warm = [rows[i][4] for _, rows in trials[1:]]
+            print('{} {} found for `{}` in `{}` ({}) in {:0.4f} seconds cold, '
+                  'warm min/median/p95 {:0.4f}/{:0.4f}/{:0.4f}'.format(
+                      n, kind, query, root, method, cold, min(warm),
+                      median(warm), percentile(warm, 95)),
+                  file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--exclude', action='store_true',
+                        help='hide {} directories from Spotlight '
+                             '(permanently)'.format(', '.join(NOISY_DIRS)))
+    args = parser.parse_args()
+    if args.exclude:
+        setup_exclusions(DIRS)
+
+    out = csv.writer(sys.stdout)
+    out.writerow([encode(f) for f in ('trial',) + FIELDS])
+
+    pool = Pool()
+    for results in bench(pool, DIRS):
+        write_results(out, results)
+    pool.close()
+    pool.join()
@@ -74,13 +74,19 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import os
-import subprocess
 import re
-from fnmatch import fnmatch
-from plistlib import readPlist, writePlist
-import uuid
+import shutil
+from fnmatch import translate
 import unicodedata
 
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 from docopt import docopt
 from workflow import (Workflow, ICON_NOTE, ICON_WARNING,
                       ICON_INFO, ICON_SETTINGS, ICON_ERROR, ICON_SYNC)
@@ -122,6 +128,15 @@ SCOPE_NAMES = {
     SCOPE_ALL: 'folders and files'
 }
 
+# Spotlight conditions for each scope. None needed for SCOPE_ALL.
+# kMDItemContentType is single-valued; kMDItemContentTypeTree lists
+# every type an item conforms to, so `!=` can't reliably exclude
+# folders with it.
+SCOPE_QUERIES = {
+    SCOPE_FOLDERS: "(kMDItemContentType == 'public.folder')",
+    SCOPE_FILES: "(kMDItemContentType != 'public.folder')",
+}
+
 DEFAULT_SETTINGS = {
     'min': 1,
     'scope': SCOPE_FOLDERS
@@ -130,87 +145,167 @@ DEFAULT_SETTINGS = {
 YPOS_START = 1360
 YSIZE = 135
 
+# Command-line actions mapped to the `FuzzyFolders` methods that
+# handle them
+_DISPATCH = dict((action, 'do_' + action.replace('-', '_')) for action in (
+    'choose', 'add', 'remove', 'search', 'keyword', 'update', 'manage',
+    'load-profile', 'alfred-search', 'alfred-browse', 'load-settings',
+    'update-setting', 'settings', 'open-help'))
+
 
-SCRIPT_SEARCH = re.compile(r"""python ff.py search ".+?" (\d+)""").search
+# Script of Script Filters created by `_update_script_filters`. The
+# prefix is checked first as it's much cheaper than the regex. The regex
+# is still needed, as the ad-hoc search filter's script has the same
+# prefix, but no profile number.
+SCRIPT_PREFIX = 'python ff.py search "'
+SCRIPT_SEARCH = re.compile(r"""python ff.py search ".+?" (\d+)""").match
+
+# Replaced with ~/ in abbreviated paths
+_HOME = os.path.expanduser('~/')
 
 
 def search_in(root, query, scope):
     """Search for files under `root` matching `query`.
 
-    If `dirs_only` is True, only search for directories.
+    `scope` is one of `SCOPE_FOLDERS`, `SCOPE_FILES` or `SCOPE_ALL`.
+
+    Generator. Paths are yielded as `mdfind` outputs them, so they
+    can be filtered while Spotlight is still searching.
 
     """
-    cmd = ['mdfind', '-onlyin', root]
+    import subprocess
+
+    cmd = ['mdfind', '-0', '-onlyin', root]
     query = ["(kMDItemFSName == '*{}*'c)".format(query)]
-    if scope == SCOPE_FOLDERS:
-        query.append("(kMDItemContentType == 'public.folder')")
-    elif scope == SCOPE_FILES:
-        query.append("(kMDItemContentType != 'public.folder')")
+    if scope in SCOPE_QUERIES:
+        query.append(SCOPE_QUERIES[scope])
 
     cmd.append(' && '.join(query))
-    log.debug(cmd)
-    output = subprocess.check_output(cmd).decode('utf-8')
-    output = unicodedata.normalize('NFC', output)
-    paths = [s.strip() for s in output.split('\n') if s.strip()]
-    log.debug('%d hits from Spotlight index', len(paths))
-    return paths
+    log.debug('cmd=%r', cmd)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    # Paths are NUL-terminated (``-0``), as filenames may contain
+    # newlines
+    fd = proc.stdout.fileno()
+    rest = b''
+    for chunk in iter(lambda: os.read(fd, 65536), b''):
+        # Decode and normalise each batch of complete records in one
+        # go. NUL can't occur inside a UTF-8 sequence, so splitting
+        # afterwards is safe
+        data, sep, rest = (rest + chunk).rpartition(b'\x00')
+        if data:
+            data = unicodedata.normalize('NFC', data.decode('utf-8'))
+            for path in data.split('\x00'):
+                if path:
+                    yield path
+    if rest:
+        yield unicodedata.normalize('NFC', rest.decode('utf-8'))
+    proc.stdout.close()
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
 
 
 def filter_excludes(paths, root, patterns):
-    """Return subset of `paths` not matching patterns.
+    """Return iterator over `paths` not matching patterns.
 
     `root` is the root fuzzy folder. It's removed from paths before
     matching.
 
+    The patterns are combined into a single regular expression, so
+    each path is only matched once.
+
     """
     log.debug('exclude patterns: %r', patterns)
-    hits = []
-    for path in paths:
-        search_path = path.replace(root, '')
-        for pat in patterns:
-            match = False
-            if fnmatch(search_path, pat):
-                log.debug('match: %r --> %r', pat, search_path)
-                match = True
-                break
-        if match:
-            continue
-        else:
-            hits.append(path)
-    log.debug('%d/%d after blacklist filtering', len(hits), len(paths))
-    return hits
+    if not patterns:
+        return iter(paths)
+    if len(patterns) == 1:
+        match = re.compile(translate(patterns[0])).match
+    else:
+        match = re.compile('|'.join([translate(pat)
+                                     for pat in patterns])).match
+    n = len(root)
+    return (path for path in paths
+            if not match(path[n:] if path.startswith(root) else path))
 
 
 def filter_paths(queries, paths, root):
-    """Return subset of `paths` that match `queries`.
+    """Yield those `paths` that match `queries`.
 
     Matching `paths` are those whose path segments contain the elements
     in ``queries` in the same order. Case-insensitive.
 
     """
-    hits = set()
     queries = [q.lower() for q in queries]
-    for i, p in enumerate(paths):
-        # Split path into lower-case components,
-        # removing the last one (matched by Spotlight)
-        components = p.replace(root, '').lower().split('/')[:-1]
-        matches = 0
+    # A query containing a slash can't be contained in a single segment
+    if any('/' in q for q in queries):
+        return
+    n = len(root)
+    for p in paths:
+        # Lower-case path relative to `root`, minus the last
+        # component (matched by Spotlight)
+        hay = (p[n:] if p.startswith(root) else p).lower()
+        cut = hay.rfind('/')
+        if cut < 0:
+            continue
+        hay = hay[:cut]
+        # Find each query in turn, starting from the beginning of the
+        # segment the previous one matched in: a segment may match
+        # several consecutive queries
+        pos = 0
         for q in queries:
-            for j, s in enumerate(components):
-                if q in s:
-                    log.debug('%r in %r', q, components)
-                    matches += 1
-                    components = components[j:]
-                    break
-        if matches == len(queries):
+            i = hay.find(q, pos)
+            if i < 0:
+                break
+            pos = hay.rfind('/', 0, i) + 1
+        else:
             log.debug('match: %r --> %r', queries, p)
-            hits.add(i)
-    log.debug('%d/%d after filtering', len(hits), len(paths))
-    return [p for i, p in enumerate(paths) if i in hits]
+            yield p
+
+
+def _abbr(path):
+    """Replace home directory at start of `path` with ``~/``."""
+    if path.startswith(_HOME):
+        return '~/' + path[len(_HOME):]
+    return path
+
+
+def _read_plist(path):
+    """Return the contents of the plist at `path`.
+
+    Uses :func:`plistlib.load` where available (Python 3.4+), which
+    reads binary as well as XML plists.
+
+    """
+    import plistlib
+    if hasattr(plistlib, 'load'):
+        with open(path, 'rb') as fp:
+            return plistlib.load(fp)
+    return plistlib.readPlist(path)
+
+
+def _write_plist(obj, path):
+    """Write `obj` to `path` as an XML plist.
+
+    Uses :func:`plistlib.dump` where available (Python 3.4+). The
+    file stays XML so it remains editable in Alfred and by hand.
+
+    """
+    import plistlib
+    if hasattr(plistlib, 'dump'):
+        with open(path, 'wb') as fp:
+            plistlib.dump(obj, fp, fmt=plistlib.FMT_XML)
+    else:
+        plistlib.writePlist(obj, path)
 
 
 class Dirpath(unicode):
-    """Helper for formatting directory paths."""
+    """Helper for formatting directory paths.
+
+    Always create instances with :meth:`dirpath`, which makes the path
+    absolute, so the properties needn't.
+
+    """
+
+    __slots__ = ()
 
     @classmethod
     def dirpath(cls, path):
@@ -220,7 +315,7 @@ class Dirpath(unicode):
     @property
     def abs_slash(self):
         """Return absolute path with trailing slash."""
-        p = os.path.abspath(self)
+        p = unicode(self)
         if not p.endswith('/'):
             return p + '/'
         return p
@@ -228,7 +323,7 @@ class Dirpath(unicode):
     @property
     def abs_noslash(self):
         """Return absolute path with no trailing slash."""
-        p = os.path.abspath(self)
+        p = unicode(self)
         if p.endswith('/') and p not in ('/', '~/'):
             return p[:-1]
         return p
@@ -236,7 +331,7 @@ class Dirpath(unicode):
     @property
     def abbr_slash(self):
         """Return abbreviated path with trailing slash."""
-        p = self.abs_slash.replace(os.path.expanduser('~/'), '~/')
+        p = _abbr(self.abs_slash)
         if not p.endswith('/'):
             return p + '/'
         return p
@@ -244,20 +339,21 @@ class Dirpath(unicode):
     @property
     def abbr_noslash(self):
         """Return abbreviated path with no trailing slash."""
-        p = self.abs_slash.replace(os.path.expanduser('~/'), '~/')
+        p = _abbr(self.abs_slash)
         if p.endswith('/') and p not in ('/', '~/'):
             return p[:-1]
         return p
 
     def splitquery(self):
         """Split into dirpath and query."""
-        if not os.path.exists(self.abs_slash):
+        if not os.path.isdir(self):
             pos = self.abs_noslash.rfind('/')
             if pos > -1:  # query
+                # Already absolute, so no need for `dirpath()`
                 if pos == 0:
-                    dirpath = Dirpath.dirpath('/')
+                    dirpath = Dirpath('/')
                 else:
-                    dirpath = Dirpath.dirpath(self[:pos])
+                    dirpath = Dirpath(self[:pos])
 
                 query = self[pos+1:]
                 log.debug('dirpath=%r,  query=%r', dirpath, query)
@@ -274,6 +370,7 @@ class FuzzyFolders(object):
         self.wf = wf
         self.dirpath = None
         self.query = None
+        self.profiles = {}
 
     def run(self, args):
         """Run the workflow/application."""
@@ -285,16 +382,11 @@ class FuzzyFolders(object):
             self.dirpath = Dirpath.dirpath(args['<dir>'])
         self.query = args['<query>']
         self.profile = args['<profile>']
+        self.profiles = self.wf.settings.get('profiles', {})
         log.debug('dirpath=%r,  query=%r', self.dirpath, self.query)
 
-        actions = ('choose', 'add', 'remove', 'search', 'keyword',
-                   'update', 'manage', 'load-profile', 'alfred-search',
-                   'alfred-browse', 'load-settings', 'update-setting',
-                   'settings', 'open-help')
-
-        for action in actions:
+        for action, methname in _DISPATCH.items():
             if args.get(action):
-                methname = 'do_{}'.format(action.replace('-', '_'))
                 meth = getattr(self, methname, None)
                 if meth:
                     return meth()
@@ -307,7 +399,7 @@ class FuzzyFolders(object):
         """Show a list of subdirectories of ``self.dirpath`` to choose from."""
         dirpath, query = self.dirpath.splitquery()
         log.debug('dirpath=%r,  query=%r', dirpath, query)
-        if not os.path.exists(dirpath) or not os.path.isdir(dirpath):
+        if not os.path.isdir(dirpath):
             log.debug('does not exist/not a directory: %r', dirpath)
             return 0
 
@@ -322,26 +414,33 @@ class FuzzyFolders(object):
                 icontype='fileicon',
                 type='file')
 
-        files = []
-        for filename in os.listdir(dirpath):
-            p = os.path.join(dirpath, filename)
-            if os.path.isdir(p) and not filename.startswith('.'):
-                files.append((filename, p))
+        if scandir is not None:
+            # Entries know if they're directories without a `stat()`
+            files = [(e.name, e.path) for e in scandir(dirpath)
+                     if not e.name.startswith('.') and e.is_dir()]
+        else:
+            files = []
+            for filename in os.listdir(dirpath):
+                p = os.path.join(dirpath, filename)
+                if os.path.isdir(p) and not filename.startswith('.'):
+                    files.append((filename, p))
 
         log.debug('%d folder(s) in %r', len(files), dirpath)
         if files and query:
-            log.debug('filtering %d files against %r'. len(files), query)
-            files = self.wf.filter(query, files, key=lambda x: x[0])
+            log.debug('filtering %d files against %r', len(files), query)
+            files = self.wf.filter(query, files, key=lambda x: x[0],
+                                   match_on=MATCH_ALL ^ MATCH_ALLCHARS)
 
         for filename, p in files:
-            p = Dirpath.dirpath(p)
+            p = Dirpath(p)  # children of an absolute path
+            abs_noslash = p.abs_noslash
             self.wf.add_item(
                 filename,
                 'Add {} as a new Fuzzy Folder'.format(p.abbr_noslash),
-                arg=p.abs_noslash,
+                arg=abs_noslash,
                 autocomplete=p.abbr_slash,
                 valid=True,
-                icon=p.abs_noslash,
+                icon=abs_noslash,
                 icontype='fileicon',
                 type='file')
 
@@ -354,12 +453,12 @@ class FuzzyFolders(object):
 
     def do_remove(self):
         """Remove existing folder."""
-        profiles = self.wf.settings.get('profiles', {})
-        if self.profile in profiles:
+        if self.profile in self.profiles:
             log.debug('Removing profile %r ...', self.profile)
+            profiles = dict(self.profiles)
             del profiles[self.profile]
-            self.wf.settings['profiles'] = profiles
-            self._update_script_filters()
+            self._update_script_filters(profiles)
+            self.wf.settings['profiles'] = self.profiles = profiles
             print('Deleted keyword / Fuzzy Folder')
         else:
             log.debug('No such profile: %r', self.profile)
@@ -369,20 +468,17 @@ class FuzzyFolders(object):
         """Search Fuzzy Folder."""
         if not self.profile:
             return self.do_ad_hoc_search()
-        profile = self.wf.settings.get('profiles', {}).get(self.profile)
+        profile = self.profiles.get(self.profile)
         if not profile:
             log.debug('Profile not found: %r', self.profile)
             return 1
 
         root = profile['dirpath']
+        defaults = self.wf.settings.get('defaults') or {}
 
-        scope = profile.get('scope', self.wf.settings.get('defaults',
-                            {}).get('scope', SCOPE_FOLDERS))
-
-        min_query = profile.get('min', self.wf.settings.get('defaults',
-                                {}).get('min', 1))
-        excludes = self.wf.settings.get('defaults', {}).get('excludes', [])
-        excludes += profile.get('excludes', [])
+        scope = profile.get('scope', defaults.get('scope', SCOPE_FOLDERS))
+        min_query = profile.get('min', defaults.get('min', 1))
+        excludes = defaults.get('excludes', []) + profile.get('excludes', [])
 
         return self._search(root, self.query, scope, min_query, excludes)
 
@@ -398,28 +494,17 @@ class FuzzyFolders(object):
         root, query = self._parse_query(self.query)
         log.debug('root=%r,  query=%r', root, query)
 
-        scope = self.wf.settings.get('defaults', {}).get('scope',
-                                                         SCOPE_FOLDERS)
+        defaults = self.wf.settings.get('defaults') or {}
 
-        min_query = self.wf.settings.get('defaults', {}).get('min', 1)
-        excludes = self.wf.settings.get('defaults', {}).get('excludes', [])
+        scope = defaults.get('scope', SCOPE_FOLDERS)
+        min_query = defaults.get('min', 1)
+        excludes = defaults.get('excludes', [])
 
         return self._search(root, query, scope, min_query, excludes)
 
     def _search(self, root, query, scope, min_query, excludes):
         """Perform search and display results."""
-        query = query.split()
-
-        if len(query) > 1:
-            mdquery = query[-1]
-            query = query[:-1]
-        elif len(query):
-            mdquery = query[0]
-            query = None
-        else:
-            mdquery = ''
-            query = None
-
+        mdquery, query = self._split_query(query)
         log.debug('mdquery=%r,  query=%r,  scope=%r', mdquery, query, scope)
 
         if len(mdquery) < min_query or not mdquery:
@@ -439,7 +524,8 @@ class FuzzyFolders(object):
         if query:
             paths = filter_paths(query, paths, root)
 
-        home = os.path.expanduser('~/')
+        paths = list(paths)
+        log.debug('%d results', len(paths))
 
         if not len(paths):
             self.wf.add_item('No results found',
@@ -447,14 +533,16 @@ class FuzzyFolders(object):
                              valid=False,
                              icon=ICON_WARNING)
 
+        # Hoist lookups out of the loop; there may be a lot of results
+        add = self.wf.add_item
+        basename = os.path.basename
         for path in paths:
-            filename = os.path.basename(path)
-            wf.add_item(filename, path.replace(home, '~/'),
-                        valid=True, arg=path,
-                        uid=path, type='file',
-                        icon=path, icontype='fileicon')
+            add(basename(path), _abbr(path),
+                valid=True, arg=path,
+                uid=path, type='file',
+                icon=path, icontype='fileicon')
 
-        wf.send_feedback()
+        self.wf.send_feedback()
         log.debug('finished search')
         return 0
 
@@ -462,7 +550,7 @@ class FuzzyFolders(object):
         """Load the corresponding profile in Alfred."""
         if self.profile == '0':
             return run_trigger('fuzzy-folders')
-        profile = self.wf.settings.get('profiles', {}).get(self.profile)
+        profile = self.profiles.get(self.profile)
         log.debug('loading profile %r ...', profile)
         return search_in_alfred(profile['keyword'] + ' ')
 
@@ -475,16 +563,14 @@ class FuzzyFolders(object):
                         valid=False,
                         icon=ICON_SYNC)
 
-        profiles = self.wf.settings.get('profiles', {})
+        items = list(self.profiles.items())
 
         if self.query:
-            items = profiles.items()
             log.debug('items: %r', items)
             items = self.wf.filter(self.query,
                                    items,
                                    key=lambda t: '{} {}'.format(t[1]['keyword'], t[1]['dirpath']),
                                    match_on=MATCH_ALL ^ MATCH_ALLCHARS)
-            profiles = dict(items)
 
         self.wf.add_item('Default Fuzzy Folder settings',
                          'View / change settings',
@@ -492,16 +578,17 @@ class FuzzyFolders(object):
                          arg="0",
                          icon=ICON_SETTINGS)
 
-        if not profiles:
+        if not items:
             self.wf.add_item(
                 'No Fuzzy Folders defined',
                 "Use the 'Add Fuzzy Folder' File Action to add some",
                 valid=False,
                 icon=ICON_WARNING)
 
-        for num, profile in profiles.items():
+        for num, profile in items:
+            dirname = Dirpath(profile['dirpath']).abbr_noslash
             self.wf.add_item('{} {} {}'.format(profile['keyword'], DELIMITER,
-                                                Dirpath.dirpath(profile['dirpath']).abbr_noslash),
+                                                dirname),
                              'View / change settings',
                              valid=True,
                              arg=num,
@@ -516,21 +603,19 @@ class FuzzyFolders(object):
         log.debug('dirpath=%r,  keyword=%r', dirpath, keyword)
 
         # check for existing configurations for this dirpath and keyword
-        profiles = []
+        # in a single pass over the profiles
         profile_exists = False
         keyword_warnings = []
         dirpath_warnings = []
-        for profile in self.wf.settings.get('profiles', {}).values():
-            profiles.append((profile['keyword'], profile['dirpath']))
-
-        if (keyword, dirpath.abs_noslash) in profiles:
-            profile_exists = True
-
-        for k, p in profiles:
+        abs_noslash = dirpath.abs_noslash
+        for profile in self.profiles.values():
+            k, p = profile['keyword'], profile['dirpath']
             if keyword == k:
+                if abs_noslash == p:
+                    profile_exists = True
                 keyword_warnings.append(u"'{}' searches {}".format(
                                         k, Dirpath.dirpath(p).abbr_noslash))
-            elif dirpath.abs_noslash == p:
+            elif abs_noslash == p:
                 dirpath_warnings.append(u"Folder already linked to '{}'".format(k))
 
         if self.query.endswith(DELIMITER):  # user has deleted trailing space
@@ -610,7 +695,7 @@ class FuzzyFolders(object):
         if profile == '0':  # default settings
             conf = defaults.copy()
         else:
-            conf = self.wf.settings.get('profiles', {}).get(profile)
+            conf = self.profiles.get(profile)
         log.debug('conf: %r', conf)
 
         if not setting:
@@ -763,17 +848,14 @@ class FuzzyFolders(object):
 
         dirpath, keyword = self._parse_query(self.query)
         log.debug('dirpath=%r, keyword=%r', dirpath, keyword)
-        profiles = self.wf.settings.setdefault('profiles', {})
+        profiles = dict(self.profiles)
         log.debug('profiles: %r', profiles)
-        if not profiles:
-            last = 0
-        else:
-            last = max([int(s) for s in profiles.keys()])
+        last = max(int(s) for s in profiles) if profiles else 0
         log.debug('Last profile: %d', last)
         profile = dict(keyword=keyword, dirpath=dirpath, excludes=[])
         profiles[unicode(last + 1)] = profile  # JSON requires string keys
-        self.wf.settings['profiles'] = profiles
-        self._update_script_filters()
+        self._update_script_filters(profiles)
+        self.wf.settings['profiles'] = self.profiles = profiles
         print(u"Keyword '{}' searches {}".format(keyword, Dirpath.dirpath(dirpath).abbr_noslash))
         reload_workflow()
 
@@ -790,46 +872,38 @@ class FuzzyFolders(object):
 
     def do_open_help(self):
         """Open help file in browser."""
+        import subprocess
         return subprocess.call(['open', self.wf.workflowfile('README.html')])
 
-    def _update_script_filters(self):
-        """Create / update Script Filters in info.plist to match settings."""
+    def _update_script_filters(self, profiles=None):
+        """Create / update Script Filters in info.plist to match settings.
+
+        If ``profiles`` is given, it's used instead of those in the
+        settings, so callers can save the settings afterwards.
+
+        """
         plistpath = self.wf.workflowfile('info.plist')
         plisttemp = self.wf.workflowfile('info.plist.temp')
 
-        profiles = self.wf.settings.get('profiles', {})
+        if profiles is None:
+            profiles = self.profiles
 
-        self._reset_script_filters()
+        plist = _read_plist(plistpath)
+        if not self._strip_script_filters(plist) and not profiles:
+            log.debug('No Script Filters to add or remove')
+            return
+
+        # backup info.plist
+        shutil.copyfile(plistpath, self.wf.workflowfile('info.plist.bak'))
 
-        plist = readPlist(plistpath)
         objects = plist['objects']
         uidata = plist['uidata']
         connections = plist['connections']
 
         y_pos = YPOS_START
         for num, profile in profiles.items():
-            uid = unicode(uuid.uuid4()).upper()
-            dirname = Dirpath.dirpath(profile['dirpath']).abbr_noslash
-            script_filter = {
-                'type': 'alfred.workflow.input.scriptfilter',
-                'uid': uid,
-                'version': 0
-            }
-            config = {
-                'argumenttype': 0,
-                'escaping': 102,
-                'keyword': profile['keyword'],
-                'runningsubtext': 'Loading files\u2026',
-                'queuedelaycustom': 3,  # Auto delay after keypress
-                'script': 'python ff.py search "$1" {}'.format(num),
-                'subtext': 'Fuzzy search across subdirectories of {}'.format(
-                    dirname),
-                'title': 'Fuzzy Search {}'.format(dirname),
-                'scriptargtype': 1,
-                'type': 0,
-                'withspace': True
-            }
-            script_filter['config'] = config
+            script_filter = self._script_filter(num, profile)
+            uid = script_filter['uid']
             objects.append(script_filter)
             # set position
             uidata[uid] = {'ypos': float(y_pos)}
@@ -841,27 +915,41 @@ class FuzzyFolders(object):
         plist['uidata'] = uidata
         plist['connections'] = connections
 
-        writePlist(plist, plisttemp)
-        os.unlink(plistpath)
+        _write_plist(plist, plisttemp)
+        # Atomically replaces info.plist on POSIX
         os.rename(plisttemp, plistpath)
         os.utime(plistpath, None)
 
         log.debug('Wrote %d Script Filters to info.plist', len(profiles))
 
-    # def _dirpath_abbr(self, dirpath=None):
-    #     """Return attr:`~FuzzyFolders.dirpath` with ``$HOME`` replaced
-    #     with ``~/``
-
-    #     """
-
-    #     if not dirpath:
-    #         dirpath = self.dirpath
-    #     if not dirpath.endswith('/'):
-    #         dirpath += '/'
-    #     dirpath = dirpath.replace(os.path.expanduser('~/'), '~/')
-    #     if dirpath.endswith('/') and dirpath not in ('/', '~/'):
-    #         dirpath = dirpath[:-1]
-    #     return dirpath
+    def _script_filter(self, num, profile):
+        """Return a new Script Filter object for profile number `num`."""
+        import uuid
+
+        uid = unicode(uuid.uuid4()).upper()
+        # Saved dirpaths are already absolute (see `_parse_query`)
+        dirname = Dirpath(profile['dirpath']).abbr_noslash
+        script_filter = {
+            'type': 'alfred.workflow.input.scriptfilter',
+            'uid': uid,
+            'version': 0
+        }
+        config = {
+            'argumenttype': 0,
+            'escaping': 102,
+            'keyword': profile['keyword'],
+            'runningsubtext': 'Loading files\u2026',
+            'queuedelaycustom': 3,  # Auto delay after keypress
+            'script': 'python ff.py search "$1" {}'.format(num),
+            'subtext': 'Fuzzy search across subdirectories of {}'.format(
+                dirname),
+            'title': 'Fuzzy Search {}'.format(dirname),
+            'scriptargtype': 1,
+            'type': 0,
+            'withspace': True
+        }
+        script_filter['config'] = config
+        return script_filter
 
     def _parse_query(self, query):
         """Split ``query`` into ``dirpath`` and ``query``.
@@ -869,12 +957,26 @@ class FuzzyFolders(object):
         :returns: ``(dirpath, query)`` where either may be empty
 
         """
-        components = query.split(DELIMITER)
-        if not len(components) == 2:
+        dirpath, sep, rest = query.partition(DELIMITER)
+        if not sep or DELIMITER in rest:
             raise ValueError('Too many components in : {!r}'.format(query))
-        dirpath, query = [s.strip() for s in components]
-        dirpath = Dirpath.dirpath(dirpath)
-        return (dirpath, query)
+        dirpath = Dirpath.dirpath(dirpath.strip())
+        return (dirpath, rest.strip())
+
+    def _split_query(self, query):
+        """Split search ``query`` into Spotlight and path queries.
+
+        The last word is passed to Spotlight, the others are used to
+        filter the paths it returns.
+
+        :returns: ``(mdquery, queries)`` where ``queries`` is ``None``
+            if there's only one word
+
+        """
+        words = query.split()
+        if not words:
+            return '', None
+        return words[-1], words[:-1] or None
 
     def _parse_settings(self, query):
         """Split ``query`` into ``profile``, ``setting`` and ``value``."""
@@ -886,21 +988,17 @@ class FuzzyFolders(object):
             setting = components[1]
         if len(components) > 2 and components[2]:
             value = int(components[2])
-        log.debug('profile=%, setting=%r,  value=%r', profile, setting, value)
+        log.debug('profile=%r,  setting=%r,  value=%r', profile, setting, value)
         return (profile, setting, value)
 
-    def _reset_script_filters(self):
-        """Load script filters from `info.plist`."""
-        plistpath = self.wf.workflowfile('info.plist')
+    def _strip_script_filters(self, plist):
+        """Remove profiles' Script Filters from `info.plist` data.
 
-        # backup info.plist
-        with open(plistpath, 'rb') as infile:
-            with open(self.wf.workflowfile('info.plist.bak'), 'wb') as outfile:
-                outfile.write(infile.read())
+        ``plist`` is modified in place.
 
-        script_filters = {}
-        plist = readPlist(plistpath)
+        :returns: number of Script Filters removed
 
+        """
         count = 0
         keep = []
         uids = set()
@@ -914,8 +1012,7 @@ class FuzzyFolders(object):
 
             script = obj.get('config', {}).get('script', '')
             log.debug('script: %r', script)
-            m = SCRIPT_SEARCH(script)
-            if not m:
+            if not script.startswith(SCRIPT_PREFIX) or not SCRIPT_SEARCH(script):
                 keep.append(obj)
                 continue
 
@@ -925,32 +1022,15 @@ class FuzzyFolders(object):
         # Overwrite objects minus script filters
         plist['objects'] = keep
 
-        # Delete positioning data
-        keep = {}
+        # Delete positioning data and connections
         uidata = plist['uidata']
-        for uid in uidata:
-            if uid not in uids:
-                keep[uid] = uidata[uid]
-
-        # Overwrite without script filter positions
-        plist['uidata'] = keep
-
-        # Remove connections
-        keep = {}
         connections = plist['connections']
-        for uid in connections:
-            if uid not in uids:
-                keep[uid] = connections[uid]
-
-        # Overwrite without script filter connections
-        plist['connections'] = keep
-
-        # Re-write info.plist without script filters
-
-        writePlist(plist, plistpath)
+        for uid in uids:
+            uidata.pop(uid, None)
+            connections.pop(uid, None)
 
         log.debug('%d Script Filters deleted from info.plist', count)
-        return script_filters
+        return count
 
 
 def main(wf):